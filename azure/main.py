@@ -1,11 +1,11 @@
-import os, datetime as dt, logging, time, json, re, traceback, base64
+import os, datetime as dt, logging, time, json, re, traceback, base64, math, socket
 from flask import Flask, request, jsonify
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 from azure.storage.blob import BlobServiceClient
-from azure.data.tables import TableServiceClient
+from azure.data.tables import TableServiceClient, UpdateMode
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openai import AzureOpenAI
 
 # Configure logging
@@ -35,6 +35,30 @@ LIKE_PATTERN = os.environ["LIKE_PATTERN"]
 STORAGE_ACCOUNT = os.environ["STORAGE_ACCOUNT"]
 KEY_VAULT_URL = os.environ["KEY_VAULT_URL"]
 
+# Packing mode defaults (overridable per request)
+PACK_TOKEN_BUDGET = int(os.environ.get("PACK_TOKEN_BUDGET", 6000))
+PACK_MAX_SIZE = int(os.environ.get("PACK_MAX_SIZE", 8))
+PACK_SHORT_TRANSCRIPT_TOKENS = int(os.environ.get("PACK_SHORT_TRANSCRIPT_TOKENS", 1500))
+PACK_MAX_OUTPUT_TOKENS = int(os.environ.get("PACK_MAX_OUTPUT_TOKENS", 4096))
+PACK_OUTPUT_TOKENS_PER_RECORD = int(os.environ.get("PACK_OUTPUT_TOKENS_PER_RECORD", 1000))
+# Largest pack whose records all fit in the packed output budget
+PACK_OUTPUT_CAP = PACK_MAX_OUTPUT_TOKENS // PACK_OUTPUT_TOKENS_PER_RECORD
+
+# Capacity planner defaults (quota of 0 means unknown / not enforced)
+AZURE_OPENAI_TPM_QUOTA = int(os.environ.get("AZURE_OPENAI_TPM_QUOTA", 0))
+INPUT_PRICE_PER_1K = float(os.environ.get("INPUT_PRICE_PER_1K", 0.0025))
+OUTPUT_PRICE_PER_1K = float(os.environ.get("OUTPUT_PRICE_PER_1K", 0.01))
+PLAN_DEFAULT_OUTPUT_TOKENS = int(os.environ.get("PLAN_DEFAULT_OUTPUT_TOKENS", 1000))
+PLAN_DEFAULT_TOKENS_PER_SECOND = float(os.environ.get("PLAN_DEFAULT_TOKENS_PER_SECOND", 50))
+PLAN_MAX_CHUNK_OVERHEAD = float(os.environ.get("PLAN_MAX_CHUNK_OVERHEAD", 0.1))
+USAGE_STATS_TABLE = os.environ.get("USAGE_STATS_TABLE", "openaiusage")
+REPLICA_NAME = os.environ.get("CONTAINER_APP_REPLICA_NAME", socket.gethostname())
+# Distinguishes restarts of the same replica so their usage rows don't overwrite each other
+PROCESS_STARTED_AT = dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+
+# Output tokens requested per single-record completion
+SINGLE_CALL_MAX_TOKENS = 4000
+
 # Initialize Azure clients
 credential = DefaultAzureCredential()
 
@@ -51,6 +75,12 @@ blob_service_client = BlobServiceClient(
     credential=credential
 )
 
+# Table Storage client (shared Azure OpenAI usage stats across replicas)
+table_service_client = TableServiceClient(
+    endpoint=f"https://{STORAGE_ACCOUNT}.table.core.windows.net",
+    credential=credential
+)
+
 # Synapse Analytics connection (using pyodbc)
 import pyodbc
 
@@ -68,20 +98,18 @@ def get_synapse_connection():
 
 fetch_lock = threading.Lock()
 
+# Wait between chunks so inserted rows are visible to the next fetch
+SYNAPSE_VISIBILITY_WAIT_SECONDS = 5
+
+# Observed Azure OpenAI throughput on this replica, keyed by mode ("single" or "packed")
+usage_lock = threading.Lock()
+openai_usage_stats = {}
+usage_table_ready = False
+
 # ========== HELPER FUNCTIONS (ADAPTED FOR AZURE) ==========
 
-def fetch_batch_transcripts(batch_size: int, start_date=None, end_date=None):
-    """
-    Fetch MULTIPLE unprocessed transcripts from Synapse Analytics.
-    
-    Args:
-        batch_size: Number of records to fetch
-        start_date: Optional start date
-        end_date: Optional end date
-    
-    Returns:
-        List of transcript dicts
-    """
+def build_eligibility_clause(start_date=None, end_date=None):
+    """Build the FROM/WHERE clause selecting unprocessed, eligible transcripts"""
     # Date filter logic
     if start_date is None and end_date is None:
         date_filter = "t.call_convrstn_utc_dt = DATEADD(day, -1, CAST(GETDATE() AS DATE))"
@@ -96,13 +124,7 @@ def fetch_batch_transcripts(batch_size: int, start_date=None, end_date=None):
         date_filter = f"t.call_convrstn_utc_dt <= '{end_date}'"
         raw_filter = f"CAST(r.ts AS DATE) <= '{end_date}'"
 
-    query = f"""
-      SELECT TOP {batch_size}
-        t.call_convrstn_id       AS call_id,
-        CAST(t.cust_id AS NVARCHAR(255)) AS cust_id,
-        t.lob AS lob,
-        t.insights_transcript_txt AS transcript_text
-      FROM {TRANSCRIPT_TABLE} t
+    return f"""FROM {TRANSCRIPT_TABLE} t
       LEFT JOIN {RAW_TABLE} r
         ON t.call_convrstn_id = r.call_convrstn_id
         AND {raw_filter}
@@ -111,7 +133,27 @@ def fetch_batch_transcripts(batch_size: int, start_date=None, end_date=None):
         AND t.lob IN {LOBS}
         AND t.insights_transcript_txt LIKE '{LIKE_PATTERN}'
         AND {date_filter}
-        AND LEN(TRIM(insights_transcript_txt)) - LEN(REPLACE(TRIM(insights_transcript_txt), ' ', '')) + 1 >= 20
+        AND LEN(TRIM(insights_transcript_txt)) - LEN(REPLACE(TRIM(insights_transcript_txt), ' ', '')) + 1 >= 20"""
+
+def fetch_batch_transcripts(batch_size: int, start_date=None, end_date=None):
+    """
+    Fetch MULTIPLE unprocessed transcripts from Synapse Analytics.
+    
+    Args:
+        batch_size: Number of records to fetch
+        start_date: Optional start date
+        end_date: Optional end date
+    
+    Returns:
+        List of transcript dicts
+    """
+    query = f"""
+      SELECT TOP {batch_size}
+        t.call_convrstn_id       AS call_id,
+        CAST(t.cust_id AS NVARCHAR(255)) AS cust_id,
+        t.lob AS lob,
+        t.insights_transcript_txt AS transcript_text
+      {build_eligibility_clause(start_date, end_date)}
     """
     
     results = []
@@ -134,6 +176,52 @@ def fetch_batch_transcripts(batch_size: int, start_date=None, end_date=None):
     logging.info(f"📦 Fetched {len(results)} records from Synapse")
     return results
 
+def fetch_plan_aggregates(start_date=None, end_date=None):
+    """
+    Count eligible transcripts and aggregate their lengths without fetching rows.
+    
+    Args:
+        start_date: Optional start date
+        end_date: Optional end date
+    
+    Returns:
+        Dict of record count, transcript length aggregates and query runtime
+    """
+    short_chars = PACK_SHORT_TRANSCRIPT_TOKENS * 4
+    
+    query = f"""
+      SELECT
+        COUNT_BIG(*) AS record_count,
+        SUM(CAST(LEN(t.insights_transcript_txt) AS BIGINT)) AS total_chars,
+        MAX(LEN(t.insights_transcript_txt)) AS max_chars,
+        SUM(CASE WHEN LEN(t.insights_transcript_txt) <= {short_chars} THEN 1 ELSE 0 END) AS short_count
+      {build_eligibility_clause(start_date, end_date)}
+    """
+    
+    conn = get_synapse_connection()
+    cursor = conn.cursor()
+    
+    try:
+        query_start = time.time()
+        cursor.execute(query)
+        row = cursor.fetchone()
+        query_seconds = time.time() - query_start
+    finally:
+        cursor.close()
+        conn.close()
+    
+    record_count = int(row.record_count or 0)
+    total_chars = int(row.total_chars or 0)
+    
+    logging.info(f"📊 Plan aggregates: {record_count:,} eligible records")
+    return {
+        "record_count": record_count,
+        "short_count": int(row.short_count or 0),
+        "avg_chars": total_chars / record_count if record_count else 0,
+        "max_chars": int(row.max_chars or 0),
+        "query_seconds": query_seconds
+    }
+
 def read_prompt_text() -> str:
     """Read prompt from Azure Blob Storage"""
     # Parse blob URI: https://storageaccount.blob.core.windows.net/container/path/to/file.txt
@@ -147,6 +235,7 @@ def call_azure_openai(prompt_text: str, transcript_text: str):
     """Call Azure OpenAI"""
     prompt = f"{prompt_text}\n\n=== TRANSCRIPT START ===\n{transcript_text}\n=== TRANSCRIPT END ==="
     
+    call_start = time.time()
     response = openai_client.chat.completions.create(
         model=AZURE_OPENAI_DEPLOYMENT,
         messages=[
@@ -154,11 +243,180 @@ def call_azure_openai(prompt_text: str, transcript_text: str):
             {"role": "user", "content": prompt}
         ],
         temperature=0.1,
-        max_tokens=4000
+        max_tokens=SINGLE_CALL_MAX_TOKENS
     )
+    record_openai_usage(response, time.time() - call_start)
     
     return response.choices[0].message.content
 
+def record_openai_usage(response, elapsed_seconds: float, records: int = 1, mode: str = "single"):
+    """Accumulate observed token usage and latency for the deployment, per processing mode"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    
+    with usage_lock:
+        stats = openai_usage_stats.setdefault(mode, {
+            "calls": 0,
+            "records": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "seconds": 0.0
+        })
+        stats["calls"] += 1
+        stats["records"] += records
+        stats["prompt_tokens"] += usage.prompt_tokens or 0
+        stats["completion_tokens"] += usage.completion_tokens or 0
+        stats["seconds"] += elapsed_seconds
+
+def flush_openai_usage():
+    """Persist this replica's cumulative usage to Table Storage so any replica can plan with it"""
+    global usage_table_ready
+    
+    with usage_lock:
+        stats_by_mode = {mode: dict(stats) for mode, stats in openai_usage_stats.items()}
+    
+    if not stats_by_mode:
+        return
+    
+    try:
+        if not usage_table_ready:
+            table_service_client.create_table_if_not_exists(USAGE_STATS_TABLE)
+            usage_table_ready = True
+        
+        table_client = table_service_client.get_table_client(USAGE_STATS_TABLE)
+        for mode, stats in stats_by_mode.items():
+            table_client.upsert_entity({
+                "PartitionKey": f"{AZURE_OPENAI_DEPLOYMENT}-{mode}",
+                "RowKey": f"{REPLICA_NAME}-{PROCESS_STARTED_AT}",
+                # Stored as doubles so large token counts round-trip as plain numbers
+                **{key: float(value) for key, value in stats.items()}
+            }, mode=UpdateMode.REPLACE)
+    except Exception as e:
+        logging.error(f"❌ Error persisting Azure OpenAI usage stats: {e}")
+
+def load_openai_usage(mode: str = "single"):
+    """Sum persisted usage across replicas for the deployment and mode, falling back to this replica"""
+    totals = {"calls": 0, "records": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0, "replicas": 0}
+    
+    try:
+        table_client = table_service_client.get_table_client(USAGE_STATS_TABLE)
+        for entity in table_client.query_entities(f"PartitionKey eq '{AZURE_OPENAI_DEPLOYMENT}-{mode}'"):
+            for key in ("calls", "records", "prompt_tokens", "completion_tokens", "seconds"):
+                totals[key] += entity.get(key) or 0
+            totals["replicas"] += 1
+    except Exception as e:
+        logging.warning(f"⚠️ Could not read persisted usage stats, using this replica only: {e}")
+    
+    if totals["replicas"] == 0:
+        with usage_lock:
+            local = openai_usage_stats.get(mode)
+            if local:
+                totals.update(local)
+                totals["replicas"] = 1
+    
+    return totals
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+def call_azure_openai_packed(prompt_text: str, transcripts: list):
+    """Call Azure OpenAI once for several short transcripts, returning (response, elapsed_seconds)"""
+    sections = []
+    for transcript in transcripts:
+        call_id = transcript["call_id"]
+        sections.append(
+            f"=== TRANSCRIPT START (call_id: {call_id}) ===\n"
+            f"{transcript['transcript_text']}\n"
+            f"=== TRANSCRIPT END (call_id: {call_id}) ==="
+        )
+
+    prompt = (
+        f"{prompt_text}\n\n"
+        f"=== PACKED MODE ===\n"
+        f"The {len(transcripts)} transcripts below are independent calls. "
+        f"Apply the instructions above to EACH transcript separately.\n"
+        f"Return ONLY a JSON array with exactly one element per transcript, in the form:\n"
+        f'[{{"call_id": "<call_id>", "output": <JSON object for that transcript>}}]\n\n'
+        + "\n\n".join(sections)
+    )
+
+    call_start = time.time()
+    response = openai_client.chat.completions.create(
+        model=AZURE_OPENAI_DEPLOYMENT,
+        messages=[
+            {"role": "system", "content": "You are an expert at analyzing customer service call transcripts."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1,
+        max_tokens=PACK_MAX_OUTPUT_TOKENS
+    )
+
+    return response, time.time() - call_start
+
+def parse_packed_openai_output(openai_text):
+    """
+    Extract and parse a packed JSON array from Azure OpenAI response.
+    Returns a dict of call_id -> (parsed output, raw element text), or None if malformed.
+    """
+    try:
+        cleaned = openai_text.strip()
+
+        # Remove markdown code blocks
+        cleaned = re.sub(r'^```(?:json)?\s*\n', '', cleaned)
+        cleaned = re.sub(r'\n```\s*$', '', cleaned)
+
+        # Find JSON array boundaries
+        first_bracket = cleaned.find('[')
+        last_bracket = cleaned.rfind(']')
+
+        if first_bracket == -1 or last_bracket == -1:
+            logging.error(f"❌ No JSON array found in packed response")
+            return None
+
+        json_only = cleaned[first_bracket:last_bracket + 1]
+
+        # Decode element by element to keep each element's raw text as the model wrote it
+        decoder = json.JSONDecoder()
+        whitespace = re.compile(r'\s*')
+        elements = []
+        pos = whitespace.match(json_only, 1).end()
+
+        while json_only[pos] != ']':
+            item, end = decoder.raw_decode(json_only, pos)
+            elements.append((item, json_only[pos:end]))
+            pos = whitespace.match(json_only, end).end()
+            if json_only[pos] == ',':
+                pos = whitespace.match(json_only, pos + 1).end()
+            elif json_only[pos] != ']':
+                raise json.JSONDecodeError("Expecting ',' or ']'", json_only, pos)
+
+        if pos != len(json_only) - 1:
+            raise json.JSONDecodeError("Extra data", json_only, pos)
+
+        outputs = {}
+        for item, raw_text in elements:
+            if not isinstance(item, dict) or item.get("call_id") is None:
+                continue
+            output = item.get("output")
+            if isinstance(output, dict):
+                outputs[str(item["call_id"])] = (output, raw_text)
+
+        logging.info(f"✅ Successfully parsed packed output ({len(outputs)} calls)")
+        return outputs
+
+    except json.JSONDecodeError as e:
+        logging.error(f"❌ Packed JSON parse error: {e}")
+        logging.error(f"Raw output (first 500 chars): {openai_text[:500]}...")
+        return None
+
+    except Exception as e:
+        logging.error(f"❌ Unexpected packed parsing error: {e}")
+        return None
+
 def parse_openai_output(openai_text):
     """
     Extract and parse JSON from Azure OpenAI response.
@@ -216,6 +474,18 @@ def get_field_safe(data, *possible_names):
             return data[lowercase_name]
     return None
 
+def parse_bool(value):
+    """Strictly parse a boolean flag from JSON (true/false, 1/0, "true"/"false")"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "1"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0"):
+        return False
+    raise ValueError(f"Expected a boolean, got {value!r}")
+
 def safe_integer(value):
     """Convert value to integer, handling non-numeric values"""
     if value is None:
@@ -524,11 +794,146 @@ def process_single_record(prompt_text: str, transcript: dict):
         logging.error(f"❌ Error processing record: {e}")
         return {"status": "failed"}
 
+class AdaptivePackSizer:
+    """
+    Adjust pack size based on the observed packed parse success rate.
+    Pack size ranges from 2 to max_size; max_size must be at least 2.
+    """
+
+    def __init__(self, max_size: int, initial_size: int = 4):
+        if max_size < 2:
+            raise ValueError("Pack max size must be at least 2")
+        self.max_size = max_size
+        self.size = min(max(2, initial_size), self.max_size)
+        self.success_rate = 1.0
+        self.lock = threading.Lock()
+
+    def current_size(self) -> int:
+        with self.lock:
+            return self.size
+
+    def record(self, success: bool):
+        with self.lock:
+            # Exponentially weighted success rate
+            self.success_rate = 0.8 * self.success_rate + 0.2 * (1.0 if success else 0.0)
+
+            if not success and self.success_rate < 0.8:
+                self.size = max(2, self.size // 2)
+            elif success and self.success_rate >= 0.95:
+                self.size = min(self.max_size, self.size + 1)
+
+            logging.info(
+                f"📐 Pack size: {self.size} | "
+                f"Parse success rate: {self.success_rate:.2f}"
+            )
+
+def build_packs(transcripts: list, pack_size: int, token_budget: int):
+    """
+    Split transcripts into packs of short transcripts and singles.
+
+    Returns:
+        (packs, singles) where packs is a list of transcript lists
+    """
+    packs = []
+    singles = []
+    current_pack = []
+    current_tokens = 0
+
+    for transcript in transcripts:
+        tokens = estimate_tokens(transcript["transcript_text"])
+
+        if tokens > PACK_SHORT_TRANSCRIPT_TOKENS or tokens > token_budget:
+            singles.append(transcript)
+            continue
+
+        if current_pack and (len(current_pack) >= pack_size or current_tokens + tokens > token_budget):
+            packs.append(current_pack)
+            current_pack = []
+            current_tokens = 0
+
+        current_pack.append(transcript)
+        current_tokens += tokens
+
+    if current_pack:
+        packs.append(current_pack)
+
+    # A pack of one gains nothing over single-call processing
+    singles.extend(pack[0] for pack in packs if len(pack) == 1)
+    packs = [pack for pack in packs if len(pack) > 1]
+
+    return packs, singles
+
+def process_packed_records(prompt_text: str, transcripts: list, pack_sizer: AdaptivePackSizer):
+    """
+    Process several short records in ONE completion.
+    Records that need single-call processing are returned as "fallback" for the caller to dispatch.
+    """
+    try:
+        response, elapsed_seconds = call_azure_openai_packed(prompt_text, transcripts)
+        openai_text = response.choices[0].message.content
+        finish_reason = response.choices[0].finish_reason
+    except Exception as e:
+        # API errors (throttling, rejected requests) say nothing about parse success;
+        # leave the records unprocessed so a later fetch picks them up again
+        logging.error(f"❌ Error calling Azure OpenAI for pack of {len(transcripts)} records: {e}")
+        return {
+            "status": "packed",
+            "results": [{"status": "failed", "call_id": transcript["call_id"]} for transcript in transcripts],
+            "fallback": []
+        }
+
+    if finish_reason == "length":
+        logging.warning(f"⚠️ Packed response truncated at {PACK_MAX_OUTPUT_TOKENS} tokens")
+        outputs = None
+    else:
+        outputs = parse_packed_openai_output(openai_text)
+
+    # Count only records the pack actually extracted, so tokens spent on
+    # truncated or malformed output are charged to the records that succeeded
+    extracted = sum(1 for transcript in transcripts if str(transcript["call_id"]) in (outputs or {}))
+    record_openai_usage(response, elapsed_seconds, extracted, mode="packed")
+
+    if outputs is None:
+        pack_sizer.record(False)
+        logging.warning(f"⚠️ Malformed packed response, falling back to single calls for {len(transcripts)} records")
+        return {"status": "packed", "results": [], "fallback": transcripts}
+
+    results = []
+    fallback = []
+
+    for transcript in transcripts:
+        call_id = transcript["call_id"]
+        cust_id = transcript.get("cust_id")
+        lob = transcript.get("lob")
+        if str(call_id) not in outputs:
+            fallback.append(transcript)
+            continue
+
+        parsed_output, raw_text = outputs[str(call_id)]
+
+        try:
+            insert_raw_output(call_id, cust_id, raw_text)
+            insert_call_extraction(call_id, cust_id, lob, parsed_output)
+            results.append({"status": "success", "call_id": call_id})
+        except Exception as e:
+            logging.error(f"❌ Error processing packed record {call_id}: {e}")
+            results.append({"status": "failed", "call_id": call_id})
+
+    pack_sizer.record(not fallback)
+
+    if fallback:
+        logging.warning(f"⚠️ {len(fallback)} records missing from packed response, falling back to single calls")
+
+    return {"status": "packed", "results": results, "fallback": fallback}
+
 def process_batch_parallel(trace_id: str, max_workers: int = 30, max_records: int = 100, 
-                          chunk_size: int = 50, start_date=None, end_date=None):
+                          chunk_size: int = 50, start_date=None, end_date=None,
+                          pack_mode: bool = False, pack_token_budget: int = PACK_TOKEN_BUDGET,
+                          pack_max_size: int = PACK_MAX_SIZE):
     """Process records in parallel"""
     start_time = time.time()
     prompt_text = read_prompt_text()
+    pack_sizer = AdaptivePackSizer(min(pack_max_size, PACK_OUTPUT_CAP)) if pack_mode else None
     
     processed_count = 0
     failed_count = 0
@@ -540,6 +945,7 @@ def process_batch_parallel(trace_id: str, max_workers: int = 30, max_records: in
         f"Max records: {max_records} | "
         f"Chunk size: {chunk_size} | "
         f"Date range: {start_date or 'yesterday'} to {end_date or 'yesterday'} | "
+        f"Pack mode: {pack_mode} | "
         f"TraceID: {trace_id}"
     )
     
@@ -562,20 +968,41 @@ def process_batch_parallel(trace_id: str, max_workers: int = 30, max_records: in
             
             logging.info(f"📦 Processing {len(transcripts)} records in parallel...")
             
+            if pack_mode:
+                packs, singles = build_packs(transcripts, pack_sizer.current_size(), pack_token_budget)
+                logging.info(f"📦 Packed {len(transcripts) - len(singles)} records into {len(packs)} packs, {len(singles)} single")
+            else:
+                packs, singles = [], transcripts
+            
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
                 futures = [executor.submit(process_single_record, prompt_text, transcript) 
-                          for transcript in transcripts]
+                          for transcript in singles]
+                futures += [executor.submit(process_packed_records, prompt_text, pack, pack_sizer)
+                           for pack in packs]
                 
                 chunk_processed = 0
                 chunk_failed = 0
+                pending = set(futures)
                 
-                for future in as_completed(futures):
-                    result = future.result()
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
                     
-                    if result["status"] == "success":
-                        chunk_processed += 1
-                    elif result["status"] == "failed":
-                        chunk_failed += 1
+                    for future in done:
+                        result = future.result()
+                        
+                        if result["status"] == "packed":
+                            # Dispatch fallback records on the pool rather than serially
+                            pending |= {executor.submit(process_single_record, prompt_text, transcript)
+                                        for transcript in result["fallback"]}
+                            record_results = result["results"]
+                        else:
+                            record_results = [result]
+                        
+                        for record_result in record_results:
+                            if record_result["status"] == "success":
+                                chunk_processed += 1
+                            elif record_result["status"] == "failed":
+                                chunk_failed += 1
                 
                 processed_count += chunk_processed
                 failed_count += chunk_failed
@@ -587,8 +1014,10 @@ def process_batch_parallel(trace_id: str, max_workers: int = 30, max_records: in
                     f"Total: {processed_count}/{max_records}"
                 )
             
-            logging.info(f"⏳ Waiting 5 seconds for Synapse visibility...")
-            time.sleep(5)
+            flush_openai_usage()
+            
+            logging.info(f"⏳ Waiting {SYNAPSE_VISIBILITY_WAIT_SECONDS} seconds for Synapse visibility...")
+            time.sleep(SYNAPSE_VISIBILITY_WAIT_SECONDS)
     
     total_time = time.time() - start_time
     rate = processed_count / total_time if total_time > 0 else 0
@@ -617,6 +1046,147 @@ def process_batch_parallel(trace_id: str, max_workers: int = 30, max_records: in
         "rate_per_second": round(rate, 2)
     }
 
+def estimate_capacity_plan(start_date=None, end_date=None, worker_options=(5, 10, 20, 30, 50),
+                           tpm_quota: int = AZURE_OPENAI_TPM_QUOTA):
+    """Estimate records, tokens, cost and wall time for a single-call backfill without processing it"""
+    worker_options = sorted(set(worker_options))
+    aggregates = fetch_plan_aggregates(start_date, end_date)
+    record_count = aggregates["record_count"]
+
+    # Token usage and generation speed: observed across replicas if available, otherwise defaults
+    stats = load_openai_usage()
+
+    if stats["records"] > 0 and stats["seconds"] > 0 and stats["completion_tokens"] > 0:
+        source = "observed"
+        input_tokens_per_record = stats["prompt_tokens"] / stats["records"]
+        output_tokens_per_record = stats["completion_tokens"] / stats["records"]
+        tokens_per_second = stats["completion_tokens"] / stats["seconds"]
+    else:
+        source = "default"
+        if PLAN_DEFAULT_OUTPUT_TOKENS <= 0 or PLAN_DEFAULT_TOKENS_PER_SECOND <= 0:
+            raise RuntimeError("PLAN_DEFAULT_OUTPUT_TOKENS and PLAN_DEFAULT_TOKENS_PER_SECOND must be positive")
+        # Input tokens: prompt + system message + average transcript
+        input_tokens_per_record = (
+            estimate_tokens(read_prompt_text())
+            + estimate_tokens("You are an expert at analyzing customer service call transcripts.")
+            + int(aggregates["avg_chars"]) // 4 + 1
+        )
+        output_tokens_per_record = PLAN_DEFAULT_OUTPUT_TOKENS
+        tokens_per_second = PLAN_DEFAULT_TOKENS_PER_SECOND
+
+    seconds_per_record = output_tokens_per_record / tokens_per_second
+
+    # Azure charges TPM on prompt tokens plus the requested max_tokens, not the tokens generated
+    quota_tokens_per_record = input_tokens_per_record + SINGLE_CALL_MAX_TOKENS
+
+    # Quota ceiling in records/sec (Azure allots 6 RPM per 1,000 TPM)
+    if tpm_quota:
+        quota_rate = min(
+            tpm_quota / 60 / quota_tokens_per_record,
+            tpm_quota / 1000 * 6 / 60
+        )
+    else:
+        quota_rate = None
+
+    # Every chunk re-runs the eligibility query and then waits for Synapse visibility.
+    # The aggregate query scans the same eligible set, so its runtime bounds the fetch cost.
+    chunk_overhead_seconds = aggregates["query_seconds"] + SYNAPSE_VISIBILITY_WAIT_SECONDS
+
+    estimates = []
+    for workers in worker_options:
+        worker_rate = workers / seconds_per_record
+        rate = min(worker_rate, quota_rate) if quota_rate else worker_rate
+        limited_by = "quota" if quota_rate and quota_rate < worker_rate else "workers"
+
+        # Smallest multiple of workers keeping per-chunk overhead within the target share of chunk work
+        chunk_size = math.ceil(rate * chunk_overhead_seconds / PLAN_MAX_CHUNK_OVERHEAD)
+        chunk_size = max(workers, math.ceil(chunk_size / workers) * workers)
+        if record_count:
+            chunk_size = min(chunk_size, record_count)
+        chunks = math.ceil(record_count / chunk_size)
+        wall_seconds = record_count / rate + chunks * chunk_overhead_seconds
+
+        estimates.append({
+            "max_workers": workers,
+            "chunk_size": chunk_size,
+            "records_per_second": round(rate, 2),
+            "wall_time_hours": round(wall_seconds / 3600, 2),
+            "limited_by": limited_by
+        })
+
+    if quota_rate:
+        # Smallest worker count within 10% of the best achievable rate
+        best_rate = max(e["records_per_second"] for e in estimates)
+        recommended = next(e for e in estimates if e["records_per_second"] >= 0.9 * best_rate)
+        recommendation = {
+            "maxRecords": record_count,
+            "maxWorkers": recommended["max_workers"],
+            "chunkSize": recommended["chunk_size"],
+            "wall_time_hours": recommended["wall_time_hours"]
+        }
+        recommendation_reason = None
+    else:
+        # Without a quota, throughput grows with workers; recommend a chunk size for each option
+        recommendation = {
+            "maxRecords": record_count,
+            "maxWorkers": None,
+            "chunkSizeByWorkers": {e["max_workers"]: e["chunk_size"] for e in estimates}
+        }
+        recommendation_reason = (
+            "No TPM quota known (set tpmQuota or AZURE_OPENAI_TPM_QUOTA), so no worker count "
+            "saturates throughput; pick maxWorkers from the estimates"
+        )
+
+    total_input_tokens = int(record_count * input_tokens_per_record)
+    total_output_tokens = int(record_count * output_tokens_per_record)
+    input_cost = total_input_tokens / 1000 * INPUT_PRICE_PER_1K
+    output_cost = total_output_tokens / 1000 * OUTPUT_PRICE_PER_1K
+
+    logging.info(
+        f"📊 PLAN | "
+        f"Records: {record_count:,} | "
+        f"Tokens: {total_input_tokens + total_output_tokens:,} | "
+        f"Cost: ${input_cost + output_cost:,.2f} | "
+        f"Throughput source: {source} | "
+        f"Recommendation: {recommendation}"
+    )
+
+    return {
+        "records": {
+            "eligible": record_count,
+            "short": aggregates["short_count"],
+            "avg_chars": round(aggregates["avg_chars"], 1),
+            "max_chars": aggregates["max_chars"],
+            "query_seconds": round(aggregates["query_seconds"], 2)
+        },
+        "tokens": {
+            "input_per_record": round(input_tokens_per_record),
+            "output_per_record": round(output_tokens_per_record),
+            "quota_per_record": round(quota_tokens_per_record),
+            "total_input": total_input_tokens,
+            "total_output": total_output_tokens
+        },
+        "cost_usd": {
+            "input": round(input_cost, 2),
+            "output": round(output_cost, 2),
+            "total": round(input_cost + output_cost, 2)
+        },
+        "throughput": {
+            "deployment": AZURE_OPENAI_DEPLOYMENT,
+            "source": source,
+            "observed_replicas": stats["replicas"],
+            "observed_calls": int(stats["calls"]),
+            "tokens_per_second": round(tokens_per_second, 1),
+            "mode": "single",
+            "tpm_quota": tpm_quota or None,
+            "note": None if source == "observed" else
+                "No usable usage recorded for this deployment yet; run a small /process batch to calibrate"
+        },
+        "estimates": estimates,
+        "recommendation": recommendation,
+        "recommendation_reason": recommendation_reason
+    }
+
 # ========== FLASK APP ==========
 
 app = Flask(__name__)
@@ -640,6 +1210,24 @@ def process_batch():
         max_workers = payload.get("maxWorkers", 30)
         start_date = payload.get("startDate")
         end_date = payload.get("endDate")
+        try:
+            pack_mode = parse_bool(payload.get("packMode", False))
+            pack_token_budget = int(payload.get("packTokenBudget", PACK_TOKEN_BUDGET))
+            pack_max_size = int(payload.get("packMaxSize", PACK_MAX_SIZE))
+            if pack_token_budget <= 0:
+                raise ValueError("packTokenBudget must be positive")
+            if pack_max_size < 2:
+                raise ValueError("packMaxSize must be at least 2")
+            if pack_mode and PACK_OUTPUT_CAP < 2:
+                raise ValueError(
+                    f"PACK_MAX_OUTPUT_TOKENS ({PACK_MAX_OUTPUT_TOKENS}) fits fewer than 2 records of "
+                    f"PACK_OUTPUT_TOKENS_PER_RECORD ({PACK_OUTPUT_TOKENS_PER_RECORD})"
+                )
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                "ok": False,
+                "error": f"Invalid pack settings: {e}"
+            }), 400
         
         logging.info(
             f"📥 Received batch request | "
@@ -647,14 +1235,16 @@ def process_batch():
             f"Total records: {max_records} | "
             f"Chunk size: {chunk_size} | "
             f"Workers: {max_workers} | "
-            f"Date range: {start_date or 'yesterday'} to {end_date or 'yesterday'}"
+            f"Date range: {start_date or 'yesterday'} to {end_date or 'yesterday'} | "
+            f"Pack mode: {pack_mode}"
         )
 
         ensure_raw_table_exists()
         
         def process_in_background():
             try:
-                result = process_batch_parallel(trace_id, max_workers, max_records, chunk_size, start_date, end_date)
+                result = process_batch_parallel(trace_id, max_workers, max_records, chunk_size, start_date, end_date,
+                                                pack_mode, pack_token_budget, pack_max_size)
                 logging.info(f"✅ Background processing complete - {result}")
             except Exception as e:
                 logging.error(f"❌ Background processing failed - {e}")
@@ -669,6 +1259,7 @@ def process_batch():
             "max_records": max_records,
             "start_date": start_date or "yesterday",
             "end_date": end_date or "yesterday",
+            "pack_mode": pack_mode,
             "message": "Processing started in background"
         }), 200
         
@@ -679,5 +1270,61 @@ def process_batch():
             "error": str(e)
         }), 500
 
+@app.route("/plan", methods=["POST"])
+def plan_batch():
+    """HTTP endpoint for dry-run capacity planning"""
+    try:
+        payload = request.get_json(force=True)
+        start_date = payload.get("startDate")
+        end_date = payload.get("endDate")
+        worker_options = payload.get("workerOptions", [5, 10, 20, 30, 50])
+        
+        if (not isinstance(worker_options, list) or not worker_options
+                or not all(isinstance(w, int) and not isinstance(w, bool) and w > 0 for w in worker_options)):
+            return jsonify({
+                "ok": False,
+                "error": "workerOptions must be a non-empty list of positive integers"
+            }), 400
+        
+        tpm_quota = payload.get("tpmQuota", AZURE_OPENAI_TPM_QUOTA)
+        if not isinstance(tpm_quota, int) or isinstance(tpm_quota, bool) or tpm_quota < 0:
+            return jsonify({
+                "ok": False,
+                "error": "tpmQuota must be a non-negative integer"
+            }), 400
+        
+        # Dates are interpolated into the eligibility SQL, so only accept ISO dates
+        try:
+            start_date = dt.date.fromisoformat(start_date).isoformat() if start_date is not None else None
+            end_date = dt.date.fromisoformat(end_date).isoformat() if end_date is not None else None
+        except (TypeError, ValueError):
+            return jsonify({
+                "ok": False,
+                "error": "startDate and endDate must be ISO dates (YYYY-MM-DD)"
+            }), 400
+
+        logging.info(
+            f"📥 Received plan request | "
+            f"Date range: {start_date or 'yesterday'} to {end_date or 'yesterday'} | "
+            f"Worker options: {worker_options} | "
+            f"TPM quota: {tpm_quota or 'unknown'}"
+        )
+
+        plan = estimate_capacity_plan(start_date, end_date, worker_options, tpm_quota)
+
+        return jsonify({
+            "ok": True,
+            "start_date": start_date or "yesterday",
+            "end_date": end_date or "yesterday",
+            **plan
+        }), 200
+
+    except Exception as e:
+        logging.exception("❌ Fatal error in /plan endpoint")
+        return jsonify({
+            "ok": False,
+            "error": str(e)
+        }), 500
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))